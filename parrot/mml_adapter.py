@@ -1,37 +1,125 @@
 from pathlib import Path
+import copy
 import importlib.util
+import os
 import subprocess
 import sys
+import threading
 import traceback
-from typing import Optional
-from tempfile import NamedTemporaryFile
+from typing import Dict, Optional, Tuple
+from types import ModuleType
+import tempfile
 
 ROOT = Path(__file__).resolve().parent.parent
 CONVERTER_PATH = ROOT / "mml_converter.py"
 
+# Cache of the loaded converter module keyed by the file's mtime (ns), so
+# repeated requests don't re-run spec_from_file_location/exec_module (and the
+# converter's top-level code) every time. Editing mml_converter.py invalidates
+# it naturally. A None module records a failed load: requests fail fast instead
+# of retrying the import until the file changes on disk.
+_CONVERTER_CACHE: Optional[Tuple[int, Optional[ModuleType]]] = None
+
+# Forking a fresh interpreter per request is pathological under load, so the
+# subprocess fallback is opt-in for debugging rather than a silent slow path.
+_SUBPROCESS_FALLBACK = os.environ.get("PARROT_MML_SUBPROCESS_FALLBACK", "").lower() in ("1", "true", "yes")
+
+# Resolved getattr() probes per candidate name for the cached module, so callers
+# don't re-scan four attribute names on every conversion.
+_FN_CACHE: Dict[str, Optional[object]] = {}
+
+# Which (fn_name, call_mode) succeeded last time, so subsequent conversions go
+# straight to the working signature instead of re-running the TypeError probes.
+# Modes: "path" (fn returns HTML for a path), "content" (fn takes MML text),
+# "file_out" (fn writes HTML to an output path we supply).
+_CALL_CACHE: Optional[Tuple[str, str]] = None
+
+# Converters that insist on writing a file get a tmpfs-backed path when one is
+# available, so the round-trip stays in page cache instead of hitting the disk.
+_TMP_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Candidate function names that may convert files
+_FILE_FN_CANDIDATES = ("compile_mml_to_html", "convert_file", "convert_mml_to_html", "convert")
+
+# The converter's module globals make conversion non-reentrant: parallel calls
+# would race on the shared variables/components/hashmaps dicts. All conversions
+# (state reset included) serialize behind this lock.
+_CONVERT_LOCK = threading.Lock()
+
+# Pristine post-exec snapshot of the module's top-level dicts. The converter
+# keeps per-document state in module globals (variables, components, hashmaps,
+# shared_*) and relies on a fresh exec to clear it between documents; with the
+# module cached, that state is restored from this snapshot before every
+# conversion so one page's definitions can't leak into another's render.
+_PRISTINE_STATE: Dict[str, dict] = {}
+
 def _load_converter_module():
     """
     Load the mml_converter.py from the project root (CONVERTER_PATH) using spec_from_file_location.
     This avoids depending on sys.path and ensures we load the user's file.
+
+    The loaded module is cached at module scope keyed by the file's mtime, so
+    only the first call (or a call after the file changed) pays the import cost.
     """
-    if not CONVERTER_PATH.exists():
-        print(f"[parrot] mml_converter.py not found at {CONVERTER_PATH}")
+    global _CONVERTER_CACHE, _CALL_CACHE
+
+    try:
+        mtime = os.stat(CONVERTER_PATH).st_mtime_ns
+    except OSError:
+        if _CONVERTER_CACHE is None:
+            print(f"[parrot] mml_converter.py not found at {CONVERTER_PATH}")
+        _CONVERTER_CACHE = (-1, None)
         return None
 
+    if _CONVERTER_CACHE is not None and _CONVERTER_CACHE[0] == mtime:
+        return _CONVERTER_CACHE[1]
+
+    _FN_CACHE.clear()
+    _CALL_CACHE = None
     try:
         spec = importlib.util.spec_from_file_location("mml_converter", str(CONVERTER_PATH))
         module = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(module)  # may raise; catch in caller
+        _CONVERTER_CACHE = (mtime, module)
+        _PRISTINE_STATE.clear()
+        for name, value in vars(module).items():
+            if type(value) is dict and not name.startswith("__"):
+                _PRISTINE_STATE[name] = copy.deepcopy(value)
         return module
     except Exception as e:
         print(f"[parrot] Failed to load mml_converter.py: {e}")
         traceback.print_exc()
+        # remember the broken state so requests fail fast until the file changes
+        _CONVERTER_CACHE = (mtime, None)
         return None
 
+def converter_mtime_ns() -> int:
+    """
+    Current mtime (ns) of the converter file, 0 if it's missing. Always stats
+    rather than consulting the module cache: callers use this to build cache
+    keys and validators, which must notice converter edits even on request
+    paths that never reload the module.
+    """
+    try:
+        return os.stat(CONVERTER_PATH).st_mtime_ns
+    except OSError:
+        return 0
+
+def _get_converter_fn(module: ModuleType, fn_name: str):
+    """Cached getattr(module, fn_name, None); cleared whenever the module reloads."""
+    try:
+        return _FN_CACHE[fn_name]
+    except KeyError:
+        fn = getattr(module, fn_name, None)
+        _FN_CACHE[fn_name] = fn
+        return fn
+
 def _run_subprocess_and_capture(mml_path: str) -> Optional[str]:
     """
-    Fallback: run `python mml_converter.py <mml_path> --stdout` (tries several variants)
-    and return stdout if it looks like HTML.
+    Debug fallback: run `python mml_converter.py <mml_path> --stdout` (tries
+    several variants) and return stdout if it looks like HTML. Only used when
+    PARROT_MML_SUBPROCESS_FALLBACK is set; each attempt forks a fresh
+    interpreter, which is far too slow for the request path.
     """
     attempts = [
         [sys.executable, str(CONVERTER_PATH), mml_path, "--stdout"],
@@ -50,87 +138,118 @@ def _run_subprocess_and_capture(mml_path: str) -> Optional[str]:
             print(f"[parrot] subprocess attempt failed ({' '.join(cmd)}): {e}")
     return None
 
+def warmup_converter() -> bool:
+    """
+    Load the converter module (and resolve the candidate functions) eagerly,
+    e.g. at server startup, so the first .mml request doesn't pay the import
+    cost on its own critical path. Returns True if the converter loaded.
+    """
+    with _CONVERT_LOCK:
+        module = _load_converter_module()
+        if module is None:
+            return False
+        for fn_name in _FILE_FN_CANDIDATES:
+            _get_converter_fn(module, fn_name)
+        return True
+
+def _reset_module_state(module: ModuleType) -> None:
+    """Restore the converter's dict globals to their freshly-executed state."""
+    for name, value in _PRISTINE_STATE.items():
+        setattr(module, name, copy.deepcopy(value))
+
+def _call_converter(module: ModuleType, fn, mode: str, mml_path: str) -> Optional[str]:
+    """
+    Invoke one candidate converter signature; return HTML on success, None if
+    the call produced nothing usable. May raise (notably TypeError for a wrong
+    arity); the caller decides whether to try another signature.
+    """
+    _reset_module_state(module)
+    if mode == "path":
+        ret = fn(mml_path)
+        return ret if isinstance(ret, str) and ret.strip() else None
+
+    if mode == "content":
+        with open(mml_path, "r", encoding="utf-8") as f:
+            mml_content = f.read()
+        ret = fn(mml_content)
+        return ret if isinstance(ret, str) and ret.strip() else None
+
+    # mode == "file_out": the converter writes its output to a path we supply.
+    # Only this last-resort mode touches the filesystem, and the scratch file
+    # lives on tmpfs when available.
+    fd, tmp_path = tempfile.mkstemp(suffix=".html", dir=_TMP_DIR)
+    os.close(fd)
+    try:
+        ret = fn(mml_path, tmp_path)
+        if isinstance(ret, str) and ret.strip():
+            return ret
+        try:
+            with open(tmp_path, "r", encoding="utf-8") as f:
+                data = f.read()
+        except Exception:
+            return None
+        return data if data and data.strip() else None
+    finally:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
 def convert_mml_file_to_html_string(mml_path: str) -> Optional[str]:
     """
     Convert an MML file to an HTML string using the user's converter.
 
     This function:
-    1. Loads mml_converter.py directly from project root.
-    2. Tries to call functions in several ways:
-       - fn(input_path, output_path)  (writes file)
+    1. Loads mml_converter.py directly from project root (cached).
+    2. Tries each candidate function with the cheap signatures first:
        - fn(input_path)              (returns string)
        - fn(mml_content)             (content-based converter)
-    3. If the converter writes a file, read the temp file and return its contents.
-    4. If import/calls fail, fallback to subprocess invocation.
+       - fn(input_path, output_path) (writes file; temp file, last resort)
+    3. Remembers which signature worked so later calls skip the probing.
+    4. If import/calls fail, returns None (500 upstream) rather than paying
+       for a subprocess per request; set PARROT_MML_SUBPROCESS_FALLBACK to
+       re-enable the old shell-out behaviour for debugging.
     """
-    mml_path = str(mml_path)
-    module = _load_converter_module()
-    if module is None:
-        return _run_subprocess_and_capture(mml_path)
-
-    # Candidate function names that may convert files
-    file_fn_candidates = ("compile_mml_to_html", "convert_file", "convert_mml_to_html", "convert")
-    for fn_name in file_fn_candidates:
-        fn = getattr(module, fn_name, None)
-        if not callable(fn):
-            continue
+    global _CALL_CACHE
+    with _CONVERT_LOCK:
+        mml_path = str(mml_path)
+        module = _load_converter_module()
+        if module is None:
+            return _run_subprocess_and_capture(mml_path) if _SUBPROCESS_FALLBACK else None
 
-        # Try calling with (input, out) and with (input,) and handle both return-or-write behaviours.
-        # Use a temporary file for output if needed.
-        tmp_path = None
-        try:
-            with NamedTemporaryFile("w+b", suffix=".html", delete=False) as tmp:
-                tmp_path = tmp.name
-
-            # First try calling with (input, out_path)
-            try:
-                ret = fn(mml_path, tmp_path)
-            except TypeError:
-                # try single-arg call
+        # Fast path: reuse the signature that worked last time.
+        if _CALL_CACHE is not None:
+            fn_name, mode = _CALL_CACHE
+            fn = _get_converter_fn(module, fn_name)
+            if callable(fn):
                 try:
-                    ret = fn(mml_path)
-                except TypeError:
-                    # unknown signature; skip to next candidate
-                    ret = None
-
-            # If function returned a string, use it
-            if isinstance(ret, str) and ret.strip():
-                return ret
-
-            # Otherwise, try reading the temp file if it exists
-            try:
-                with open(tmp_path, "r", encoding="utf-8") as f:
-                    data = f.read()
-                if data and data.strip():
-                    return data
-            except Exception:
-                # no usable temp output
-                pass
+                    html = _call_converter(module, fn, mode, mml_path)
+                    if html is not None:
+                        return html
+                except Exception as e:
+                    print(f"[parrot] Error when calling {fn_name}: {e}")
+                    traceback.print_exc()
+            _CALL_CACHE = None
 
-        except Exception as e:
-            print(f"[parrot] Error when calling {fn_name}: {e}")
-            traceback.print_exc()
-            # try next candidate
-            continue
-        finally:
-            if tmp_path:
-                try:
-                    Path(tmp_path).unlink()
-                except Exception:
-                    pass
+        for fn_name in _FILE_FN_CANDIDATES:
+            fn = _get_converter_fn(module, fn_name)
+            if not callable(fn):
+                continue
 
-    # Fallback: maybe the module exposes a content-based converter that takes MML text
-    content_fn = getattr(module, "convert_mml_to_html", None)
-    if callable(content_fn):
-        try:
-            with open(mml_path, "r", encoding="utf-8") as f:
-                mml_content = f.read()
-            ret = content_fn(mml_content)
-            if isinstance(ret, str) and ret.strip():
-                return ret
-        except Exception as e:
-            print(f"[parrot] Fallback content conversion failed: {e}")
-            traceback.print_exc()
+            for mode in ("path", "content", "file_out"):
+                try:
+                    html = _call_converter(module, fn, mode, mml_path)
+                except TypeError:
+                    # wrong arity; try the next calling convention
+                    continue
+                except Exception as e:
+                    print(f"[parrot] Error when calling {fn_name}: {e}")
+                    traceback.print_exc()
+                    # the function itself failed; try next candidate
+                    break
+                if html is not None:
+                    _CALL_CACHE = (fn_name, mode)
+                    return html
 
-    # Last resort: subprocess invocation
-    return _run_subprocess_and_capture(mml_path)
+        # Nothing callable worked; fail fast unless the debug fallback is enabled.
+        return _run_subprocess_and_capture(mml_path) if _SUBPROCESS_FALLBACK else None
@@ -1,28 +1,42 @@
 from aiohttp import web
-from typing import Callable, Dict, Awaitable, Optional
+from typing import Callable, Dict, Awaitable, Optional, Tuple
 import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from .static import handle_static_request
-from .mml_adapter import convert_mml_file_to_html_string
+from .static import handle_static_request, set_mml_executor
+from .mml_adapter import convert_mml_file_to_html_string, warmup_converter
 from .utils import guess_mime_type
 import json
 import logging
 
+try:
+    import orjson  # optional: serializes to bytes in C, ~2-5x faster than stdlib
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger("parrot")
 logging.basicConfig(level=logging.INFO, format="[parrot] %(message)s")
 
 HandlerType = Callable[[str, str, web.Request], Awaitable[web.StreamResponse]]
 
+_DEFAULT_METHODS = ("GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS")
+
 class HTTPServer:
     def __init__(self, host="127.0.0.1", port=8080, root=".", enable_dir_listing=False):
         self.host = host
         self.port = port
         self.root = Path(root).resolve()
         self.enable_dir_listing = enable_dir_listing
-        self._routes: Dict[str, HandlerType] = {}
+        self._routes: Dict[str, Tuple[HandlerType, frozenset]] = {}
+        # MML conversion is CPU-bound; give it its own pool sized to the CPU
+        # count instead of sharing asyncio's default executor with every other
+        # blocking call in the process.
+        self._mml_executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="mml")
+        set_mml_executor(self._mml_executor)
         self._app = web.Application()
         self._app.router.add_route('*', '/{tail:.*}', self._catch_all)
-        logger.info(f"Parrot root set to {self.root}")
+        logger.info("Parrot root set to %s", self.root)
 
     def route(self, path: str, methods: Optional[list]=None):
         """
@@ -31,29 +45,47 @@ class HTTPServer:
         Handler signature (async):
         async def handler(method: str, path: str, request: aiohttp.web.Request) -> aiohttp.web.Response
         """
-        methods = methods or ["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"]
+        methods = tuple(methods) if methods else _DEFAULT_METHODS
+        method_set = frozenset(methods)
+        if "GET" in method_set:
+            # HEAD must be answerable wherever GET is; aiohttp drops the body.
+            method_set |= {"HEAD"}
         def decorator(fn: HandlerType):
-            self._routes[path] = fn
-            logger.info(f"Registered route {path} [{','.join(methods)}]")
+            self._routes[path] = (fn, method_set)
+
+            # Register the exact path directly so aiohttp resolves it via its
+            # plain-path index instead of regex-matching the catch-all route.
+            async def aiohttp_handler(request: web.Request, _fn: HandlerType = fn):
+                return await self._run_handler(_fn, request)
+
+            for m in method_set:
+                self._app.router.add_route(m, path, aiohttp_handler)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Registered route %s [%s]", path, ",".join(methods))
             return fn
         return decorator
 
-    async def _catch_all(self, request: web.Request):
-        path = request.path
-        method = request.method.upper()
+    async def _run_handler(self, handler: HandlerType, request: web.Request):
+        try:
+            result = await handler(request.method, request.path, request)
+            if isinstance(result, web.StreamResponse):
+                return result
+            return web.Response(text=str(result))
+        except web.HTTPException:
+            raise
+        except Exception:
+            logger.exception("Route handler error")
+            return web.Response(status=500, text="Internal Server Error")
 
-        handler = self._routes.get(path)
-        if handler:
-            try:
-                result = await handler(method, path, request)
-                if isinstance(result, web.StreamResponse):
-                    return result
-                return web.Response(text=str(result))
-            except web.HTTPException as e:
-                raise
-            except Exception:
-                logger.exception("Route handler error")
-                return web.Response(status=500, text="Internal Server Error")
+    async def _catch_all(self, request: web.Request):
+        # Exact routes are registered directly on the router, so only static
+        # traffic and method mismatches end up here.
+        entry = self._routes.get(request.path)
+        if entry is not None:
+            handler, allowed_methods = entry
+            if request.method not in allowed_methods:
+                return web.Response(status=405, text="Method Not Allowed")
+            return await self._run_handler(handler, request)
 
         return await handle_static_request(request, filesystem_root=str(self.root), enable_dir_listing=self.enable_dir_listing)
 
@@ -61,16 +93,26 @@ class HTTPServer:
         runner = web.AppRunner(self._app)
         await runner.setup()
         site = web.TCPSite(runner, host=self.host, port=self.port)
-        logger.info(f"Starting parrot on http://{self.host}:{self.port}")
+        # Import the MML converter now so the first .mml request doesn't pay
+        # the module-load cost on its own critical path.
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, warmup_converter)
+        logger.info("Starting parrot on http://%s:%s", self.host, self.port)
         await site.start()
         try:
             while True:
                 await asyncio.sleep(3600)
         finally:
+            self._mml_executor.shutdown(wait=False, cancel_futures=True)
             await runner.cleanup()
 
     def json_response(self, data, status=200):
-        return web.Response(text=json.dumps(data), status=status, content_type="application/json")
+        if orjson is not None:
+            body = orjson.dumps(data)
+        else:
+            # encode ourselves so aiohttp doesn't re-encode a text= payload
+            body = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        return web.Response(body=body, status=status, content_type="application/json")
 
     async def serve_static(self, relative_path: str):
         """
@@ -82,8 +124,8 @@ class HTTPServer:
             return web.Response(status=404, text="File not found")
 
         if file_path.suffix == ".mml":
-            loop = asyncio.get_event_loop()
-            html = await loop.run_in_executor(None, convert_mml_file_to_html_string, str(file_path))
+            loop = asyncio.get_running_loop()
+            html = await loop.run_in_executor(self._mml_executor, convert_mml_file_to_html_string, str(file_path))
             if html is None:
                 return web.Response(status=500, text="MML conversion failed")
             return web.Response(text=html, content_type="text/html")
@@ -1,24 +1,71 @@
-import aiofiles
 import asyncio
+import os
 from aiohttp import web
+from collections import OrderedDict
 from pathlib import Path
-from .utils import guess_mime_type, file_mtime, compute_etag_bytes
-from .mml_adapter import convert_mml_file_to_html_string
-from datetime import datetime, timezone
+from typing import Dict, Tuple
+from .utils import guess_mime_type, file_http_date, compute_etag_bytes, file_response_etag
+from .mml_adapter import convert_mml_file_to_html_string, converter_mtime_ns
+from html import escape
 
 CHUNK_SIZE = 64 * 1024
 
-async def read_file_bytes(path: Path) -> bytes:
-    async with aiofiles.open(path, "rb") as f:
-        return await f.read()
+_MML_CONTENT_TYPE = "text/html; charset=utf-8"
+_MML_CACHE_CONTROL = "no-cache"
+
+# Bodies above this go out via an in-memory file and sendfile() instead of
+# being copied from the Python heap into aiohttp's output buffer.
+_LARGE_BODY_THRESHOLD = 256 * 1024
+
+# Pre-encoded fragments for the directory-listing page, so the branch only
+# encodes the request path and the entry names instead of formatting and
+# re-encoding the whole document per request.
+_DIRLIST_HEAD = b"<html><body><h1>Directory listing for "
+_DIRLIST_MID = b"</h1><ul>"
+_DIRLIST_TAIL = b"</ul></body></html>"
+
+# Rendered-MML cache: (path, mtime_ns, size, converter mtime_ns) ->
+# (body bytes, Last-Modified or None). The mtimes in the key make stale entries
+# unreachable, so edits to the source file or the converter invalidate
+# automatically; oldest entries are evicted past the size cap.
+_MML_CACHE_MAX = 128
+_MML_CACHE: "OrderedDict[tuple, Tuple[bytes, str]]" = OrderedDict()
+
+# Resolved filesystem roots as (Path, str, str + os.sep), so each request
+# neither redoes Path.resolve() on a root that never changes nor re-stringifies
+# it for the traversal guard.
+_ROOT_CACHE: Dict[str, Tuple[Path, str, str]] = {}
+
+_INDEX_NAMES = ("index.mml", "index.html")
+_FALLBACK_EXTS = (".mml", ".html")
+
+# Executor used for MML conversions. None means asyncio's shared default pool;
+# HTTPServer installs a dedicated CPU-sized pool so bursty .mml traffic doesn't
+# queue behind (or starve) other blocking work in the process.
+_MML_EXECUTOR = None
+
+def set_mml_executor(executor) -> None:
+    """Install the executor used for MML conversions (None restores the default)."""
+    global _MML_EXECUTOR
+    _MML_EXECUTOR = executor
+
+# Single-flight map: conversions currently running, keyed like _MML_CACHE.
+# Concurrent requests for the same file await the first conversion's Future
+# instead of each spawning an identical executor job.
+_INFLIGHT: Dict[tuple, asyncio.Future] = {}
 
 async def stream_file(response: web.StreamResponse, path: Path):
-    async with aiofiles.open(path, "rb") as f:
+    # plain stdlib reads offloaded with to_thread beat aiofiles' wrapper
+    # overhead, and the event loop stays unblocked either way
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
         while True:
-            chunk = await f.read(CHUNK_SIZE)
+            chunk = await asyncio.to_thread(f.read, CHUNK_SIZE)
             if not chunk:
                 break
             await response.write(chunk)
+    finally:
+        await asyncio.to_thread(f.close)
     await response.write_eof()
 
 async def handle_static_request(request: web.Request, filesystem_root: str, enable_dir_listing: bool = False):
@@ -35,46 +82,65 @@ async def handle_static_request(request: web.Request, filesystem_root: str, enab
     if rel_url_path == "":
         rel_url_path = request.path.lstrip("/")
 
-    root = Path(filesystem_root).resolve()
+    cached_root = _ROOT_CACHE.get(filesystem_root)
+    if cached_root is None:
+        root = Path(filesystem_root).resolve()
+        cached_root = (root, str(root), str(root) + os.sep)
+        _ROOT_CACHE[filesystem_root] = cached_root
+    root, root_str, root_prefix = cached_root
 
     joined = (root / rel_url_path).resolve()
-    if not str(joined).startswith(str(root)):
+    joined_str = str(joined)
+    # prefix check includes the separator so a sibling like /root2 can't
+    # masquerade as being under /root
+    if joined_str != root_str and not joined_str.startswith(root_prefix):
         return web.Response(status=403, text="Forbidden")
 
-    if joined.is_dir():
-        for idx in ("index.mml", "index.html"):
-            idx_path = joined / idx
-            if idx_path.exists():
-                joined = idx_path
-                break
-        else:
-            if enable_dir_listing:
-                items = []
-                for p in joined.iterdir():
-                    items.append(p.name + ("/" if p.is_dir() else ""))
-                body = "<html><body><h1>Directory listing for {}</h1><ul>{}</ul></body></html>".format(
-                    request.path, "".join(f"<li><a href=\"{name}\">{name}</a></li>" for name in items)
-                )
-                return web.Response(text=body, content_type="text/html")
-            return web.Response(status=404, text="Not Found")
+    # One scandir of the parent directory replaces the pile of per-candidate
+    # exists() stats below: every probe becomes an in-memory dict lookup.
+    try:
+        entries = {e.name: e for e in os.scandir(joined.parent)}
+    except OSError:
+        entries = {}
+
+    entry = entries.get(joined.name)
+
+    if entry is not None and entry.is_dir():
+        try:
+            dir_entries = list(os.scandir(joined))
+        except OSError:
+            dir_entries = []
+        dir_names = {e.name for e in dir_entries}
+        for idx in _INDEX_NAMES:
+            if idx in dir_names:
+                idx_path = joined / idx
+                if idx == "index.mml":
+                    return await _serve_mml(idx_path, request)
+                return await _serve_file(idx_path, request)
+        if enable_dir_listing:
+            parts = [_DIRLIST_HEAD, escape(request.path).encode("utf-8"), _DIRLIST_MID]
+            for e in dir_entries:
+                name = escape(e.name + ("/" if e.is_dir() else ""), quote=True).encode("utf-8")
+                parts.append(b'<li><a href="' + name + b'">' + name + b"</a></li>")
+            parts.append(_DIRLIST_TAIL)
+            return web.Response(body=b"".join(parts), content_type="text/html", charset="utf-8")
+        return web.Response(status=404, text="Not Found")
 
     if joined.suffix == "":
-        mml_try = joined.with_suffix(".mml")
-        html_try = joined.with_suffix(".html")
-        if mml_try.exists():
-            return await _serve_mml(mml_try, request)
-        if html_try.exists():
-            joined = html_try
-
-    if joined.suffix == ".mml" and joined.exists():
+        if (joined.name + ".mml") in entries:
+            return await _serve_mml(joined.with_suffix(".mml"), request)
+        if (joined.name + ".html") in entries:
+            return await _serve_file(joined.with_suffix(".html"), request)
+
+    if joined.suffix == ".mml" and entry is not None:
         return await _serve_mml(joined, request)
 
-    if joined.exists() and joined.is_file():
+    if entry is not None and entry.is_file():
         return await _serve_file(joined, request)
 
-    for ext in (".mml", ".html"):
+    for ext in _FALLBACK_EXTS:
         p = joined.with_suffix(ext)
-        if p.exists():
+        if p.name in entries:
             if ext == ".mml":
                 return await _serve_mml(p, request)
             else:
@@ -82,33 +148,127 @@ async def handle_static_request(request: web.Request, filesystem_root: str, enab
 
     return web.Response(status=404, text="Not Found")
 
+def _large_body_response(body: bytes, headers: dict, request: web.Request, mtime_ns: int):
+    """
+    Serve a large rendered body from an anonymous in-memory file so aiohttp
+    can sendfile() it instead of copying the bytes through its output buffer.
+    Returns None when memfd_create isn't available (non-Linux).
+    """
+    if not hasattr(os, "memfd_create"):
+        return None
+    try:
+        fd = os.memfd_create("parrot-mml")
+    except OSError:
+        return None
+    try:
+        os.write(fd, body)
+        # Pin the mtime so FileResponse's stat-derived validators stay stable
+        # across requests; it changes whenever the source or converter does.
+        os.utime(fd, ns=(mtime_ns, mtime_ns))
+    except OSError:
+        os.close(fd)
+        return None
+    # The fd must outlive the handler: FileResponse only opens /proc/self/fd/N
+    # when the response is prepared. Close it once the request task finishes.
+    request.task.add_done_callback(lambda _t, _fd=fd: os.close(_fd))
+    return web.FileResponse(Path(f"/proc/self/fd/{fd}"), headers=headers)
+
 async def _serve_mml(mml_path: Path, request: web.Request):
-    html = await asyncio.get_event_loop().run_in_executor(None, convert_mml_file_to_html_string, str(mml_path))
-    if html is None:
-        return web.Response(status=500, text="MML conversion failed")
-    body_bytes = html.encode("utf-8")
-    etag = compute_etag_bytes(body_bytes)
+    try:
+        st = os.stat(mml_path)
+    except OSError:
+        st = None
+
+    if st is not None:
+        # Weak ETag from the source and converter mtimes: cheap enough to
+        # answer a conditional GET before any conversion work happens. The
+        # converter mtime is part of the key so editing either file
+        # invalidates both the ETag and the rendered-page cache.
+        conv_mtime_ns = converter_mtime_ns()
+        cache_key = (str(mml_path), st.st_mtime_ns, st.st_size, conv_mtime_ns)
+        etag = f'W/"{st.st_mtime_ns:x}-{conv_mtime_ns:x}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag, "Cache-Control": _MML_CACHE_CONTROL})
+    else:
+        cache_key = None
+        etag = None
+
+    cached = _MML_CACHE.get(cache_key) if cache_key is not None else None
+    if cached is not None:
+        _MML_CACHE.move_to_end(cache_key)
+        body_bytes, last_modified = cached
+    else:
+        result = None
+        fut = _INFLIGHT.get(cache_key) if cache_key is not None else None
+        if fut is not None:
+            # Another request is already converting this exact file; wait for
+            # its result instead of spawning a duplicate conversion. shield()
+            # keeps our own cancellation from cancelling the shared Future.
+            result = await asyncio.shield(fut)
+        else:
+            loop = asyncio.get_running_loop()
+            if cache_key is not None:
+                fut = loop.create_future()
+                _INFLIGHT[cache_key] = fut
+            try:
+                html = await loop.run_in_executor(_MML_EXECUTOR, convert_mml_file_to_html_string, str(mml_path))
+                if html is not None:
+                    body_bytes = html.encode("utf-8")
+                    result = (body_bytes, file_http_date(mml_path))
+                    if cache_key is not None:
+                        _MML_CACHE[cache_key] = result
+                        if len(_MML_CACHE) > _MML_CACHE_MAX:
+                            _MML_CACHE.popitem(last=False)
+            finally:
+                if fut is not None:
+                    _INFLIGHT.pop(cache_key, None)
+                    if not fut.done():
+                        fut.set_result(result)
+        if result is None:
+            return web.Response(status=500, text="MML conversion failed")
+        body_bytes, last_modified = result
+
+    if etag is None:
+        etag = compute_etag_bytes(body_bytes)
+
     headers = {
-        "Content-Type": "text/html; charset=utf-8",
+        "Content-Type": _MML_CONTENT_TYPE,
         "ETag": etag,
-        "Cache-Control": "no-cache",
-        "Last-Modified": (file_mtime(mml_path) or datetime.now()).strftime("%a, %d %b %Y %H:%M:%S GMT")
+        "Cache-Control": _MML_CACHE_CONTROL,
     }
-    if_none_match = request.headers.get("If-None-Match")
-    if if_none_match and if_none_match == etag:
-        return web.Response(status=304, headers=headers)
+    if last_modified is not None:
+        headers["Last-Modified"] = last_modified
 
+    if st is not None and len(body_bytes) > _LARGE_BODY_THRESHOLD:
+        # Clients of large pages hold the memfd FileResponse's stat-derived
+        # ETag, not the weak one checked at the top, so compare against that
+        # value here - before paying for a memfd and a full body write.
+        pinned_mtime_ns = max(st.st_mtime_ns, conv_mtime_ns)
+        large_etag = file_response_etag(pinned_mtime_ns, len(body_bytes))
+        if request.headers.get("If-None-Match") == large_etag:
+            return web.Response(status=304, headers={"ETag": large_etag, "Cache-Control": _MML_CACHE_CONTROL})
+        response = _large_body_response(body_bytes, headers, request, pinned_mtime_ns)
+        if response is not None:
+            return response
     return web.Response(body=body_bytes, headers=headers)
 
 async def _serve_file(path: Path, request: web.Request):
-    mime = guess_mime_type(str(path))
-    body_bytes = await read_file_bytes(path)
-    etag = compute_etag_bytes(body_bytes)
-    headers = {
-        "Content-Type": mime,
-        "ETag": etag,
-        "Cache-Control": "public, max-age=60",
-    }
-    if request.headers.get("If-None-Match") == etag:
-        return web.Response(status=304, headers=headers)
-    return web.Response(body=body_bytes, headers=headers)
\ No newline at end of file
+    headers = {"Cache-Control": "public, max-age=60"}
+    try:
+        st = os.stat(path)
+    except OSError:
+        st = None
+
+    if st is not None:
+        # FileResponse overwrites any ETag we set with its own stat-derived
+        # validator, so the short-circuit has to compare against that exact
+        # value - it's what clients actually hold.
+        etag = file_response_etag(st.st_mtime_ns, st.st_size)
+        if request.headers.get("If-None-Match") == etag:
+            headers["ETag"] = etag
+            headers["Content-Type"] = guess_mime_type(str(path))
+            return web.Response(status=304, headers=headers)
+
+    # FileResponse streams via sendfile(2) where available, so the body never
+    # passes through Python memory.
+    return web.FileResponse(path, headers=headers)
\ No newline at end of file
@@ -1,7 +1,8 @@
+import email.utils
 import os
 import mimetypes
 import hashlib
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
 
 mimetypes.init()
@@ -12,11 +13,27 @@ def guess_mime_type(path: str) -> str:
 
 def file_mtime(path: str) -> Optional[datetime]:
     try:
-        return datetime.utcfromtimestamp(os.path.getmtime(path))
+        return datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
     except Exception:
         return None
 
+def file_http_date(path: str) -> Optional[str]:
+    """RFC 7231 date string for a file's mtime (for Last-Modified headers)."""
+    try:
+        return email.utils.formatdate(os.path.getmtime(path), usegmt=True)
+    except OSError:
+        return None
+
 def compute_etag_bytes(data: bytes) -> str:
-    h = hashlib.sha1()
-    h.update(data)
-    return h.hexdigest()
\ No newline at end of file
+    # blake2b is noticeably faster than sha1 in CPython and an ETag only needs
+    # collision resistance, not a cryptographic pedigree.
+    h = hashlib.blake2b(data, digest_size=16)
+    return h.hexdigest()
+
+def file_response_etag(mtime_ns: int, size: int) -> str:
+    """
+    The validator aiohttp's FileResponse derives from stat, pre-quoted as it
+    appears on the wire. Matching it lets conditional checks short-circuit
+    before a FileResponse is built.
+    """
+    return f'"{mtime_ns:x}-{size:x}"'
\ No newline at end of file